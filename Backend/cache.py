@@ -0,0 +1,187 @@
+"""Response caches: exact-match responses, enhanced prompts, the binary image store and the semantic cache.
+
+Everything here is per process. Request and response models are only used by attribute, so this module
+doesn't import main.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from cachetools import TTLCache
+
+logger = logging.getLogger("circuit_designer")
+
+def hash_api_key(api_key: str) -> str:
+    return hashlib.blake2b(api_key.encode(), digest_size=16).hexdigest()
+
+# Exact-match response cache for identical (api key, mode, prompt, images) requests.
+# Bounded by total payload characters rather than entry count since image responses are multi-MB.
+RESPONSE_CACHE_MAX_CHARS = int(os.environ.get("RESPONSE_CACHE_MAX_CHARS", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "600"))
+
+def _response_size(response: "CircuitGenerationResponse") -> int:
+    return len(response.text or "") + len(response.image_url or "") + 1
+
+_response_cache = TTLCache(
+    maxsize=RESPONSE_CACHE_MAX_CHARS, ttl=RESPONSE_CACHE_TTL_SECONDS, getsizeof=_response_size
+)
+
+def response_cache_key(request: "CircuitGenerationRequest") -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for field in (request.api_key, request.mode, request.prompt, request.current_image, request.painted_image):
+        h.update((field or "").encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def get_cached_response(key: str) -> Optional["CircuitGenerationResponse"]:
+    return _response_cache.get(key)
+
+def cache_response(key: str, response: "CircuitGenerationResponse") -> None:
+    # TTLCache raises for single items larger than the whole cache
+    if _response_size(response) <= RESPONSE_CACHE_MAX_CHARS:
+        _response_cache[key] = response
+
+# Generated images served from GET /img/{token} instead of inline data URLs, skipping the base64
+# encode and its 33% size overhead. Opt-in: the store is per process, so it only works when the
+# browser's follow-up request reaches the same instance (not on multi-instance serverless deploys).
+IMAGE_STORE_ENABLED = os.environ.get("IMAGE_STORE_ENABLED", "0") == "1"
+IMAGE_STORE_MAX_BYTES = int(os.environ.get("IMAGE_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Outlive response-cache entries that point at stored images
+IMAGE_STORE_TTL_SECONDS = max(int(os.environ.get("IMAGE_STORE_TTL_SECONDS", "3600")), RESPONSE_CACHE_TTL_SECONDS)
+
+# token -> (image bytes, mime type)
+_image_store = TTLCache(
+    maxsize=IMAGE_STORE_MAX_BYTES, ttl=IMAGE_STORE_TTL_SECONDS, getsizeof=lambda item: len(item[0]) or 1
+)
+# TTLCache isn't thread-safe, and images are stored from worker threads while GET /img reads on the loop
+_image_store_lock = threading.Lock()
+
+def store_image(image_bytes: bytes, mime_type: str) -> Optional[str]:
+    """Keep image bytes for GET /img/{token}; returns the URL path, or None if the image doesn't fit."""
+    if len(image_bytes) > IMAGE_STORE_MAX_BYTES:
+        return None
+    token = secrets.token_urlsafe(12)
+    item = (bytes(image_bytes), mime_type)
+    with _image_store_lock:
+        _image_store[token] = item
+    return f"/img/{token}"
+
+def get_stored_image(token: str) -> Optional[tuple[bytes, str]]:
+    """Return (image bytes, mime type) for a token, or None once it has expired or been evicted."""
+    with _image_store_lock:
+        return _image_store.get(token)
+
+# Enhanced prompts are short, so a fixed entry count bounds memory well enough
+_enhance_cache = TTLCache(maxsize=1024, ttl=RESPONSE_CACHE_TTL_SECONDS)
+
+def enhance_cache_key(request: "PromptEnhancementRequest") -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(request.api_key.encode())
+    h.update(b"\0")
+    h.update(request.prompt.encode())
+    return h.hexdigest()
+
+def get_cached_enhancement(key: str) -> Optional["PromptEnhancementResponse"]:
+    return _enhance_cache.get(key)
+
+def cache_enhancement(key: str, response: "PromptEnhancementResponse") -> None:
+    _enhance_cache[key] = response
+
+# Semantic response cache for chat mode and prompt enhancement. Opt-in: needs sentence-transformers and sqlite-vec,
+# which are too large for the default serverless bundle.
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_MODEL = os.environ.get("SEMANTIC_CACHE_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.93"))
+# Enhancement is its own tier with a stricter threshold: a small wording change to a prompt
+# should usually produce a different enhanced prompt
+ENHANCE_SEMANTIC_CACHE_ENABLED = os.environ.get("ENHANCE_SEMANTIC_CACHE_ENABLED", "0") == "1"
+ENHANCE_SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("ENHANCE_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "2048"))
+
+class SemanticCache:
+    """Text answers keyed by prompt embedding, served when cosine similarity clears a threshold."""
+
+    def __init__(self, model_name: str, ttl_seconds: int, max_entries: int):
+        import sqlite_vec
+        from sentence_transformers import SentenceTransformer
+
+        self._serialize = sqlite_vec.serialize_float32
+        self.model = SentenceTransformer(model_name)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        self.db.enable_load_extension(True)
+        sqlite_vec.load(self.db)
+        self.db.enable_load_extension(False)
+        self.db.execute(
+            "CREATE TABLE entries (namespace TEXT NOT NULL, embedding BLOB NOT NULL, text TEXT NOT NULL, created REAL NOT NULL)"
+        )
+
+    def embed(self, text: str) -> bytes:
+        vec = self.model.encode(text, normalize_embeddings=True)
+        return self._serialize(vec.tolist())
+
+    def lookup(self, namespace: str, embedding: bytes, threshold: float) -> Optional[str]:
+        with self.lock:
+            self.db.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl_seconds,))
+            row = self.db.execute(
+                "SELECT text, vec_distance_cosine(embedding, ?) AS distance FROM entries "
+                "WHERE namespace = ? ORDER BY distance LIMIT 1",
+                (embedding, namespace),
+            ).fetchone()
+        if row is None or 1.0 - row[1] < threshold:
+            return None
+        return row[0]
+
+    def embed_and_lookup(self, namespace: str, text: str, threshold: float) -> tuple[bytes, Optional[str]]:
+        """Embed `text` and look it up; blocking, so callers run it in one worker-thread hop."""
+        embedding = self.embed(text)
+        return embedding, self.lookup(namespace, embedding, threshold)
+
+    def insert(self, namespace: str, embedding: bytes, text: str) -> None:
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO entries (namespace, embedding, text, created) VALUES (?, ?, ?, ?)",
+                (namespace, embedding, text, time.time()),
+            )
+            self.db.execute(
+                "DELETE FROM entries WHERE rowid NOT IN (SELECT rowid FROM entries ORDER BY created DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+_semantic_cache = None
+_semantic_cache_failed = False
+# Concurrent first requests wait for one build instead of each loading the model
+_semantic_cache_build_lock = threading.Lock()
+
+def build_semantic_cache() -> Optional[SemanticCache]:
+    """Load the embedding model and vector store; blocking, so it runs in a worker thread."""
+    global _semantic_cache, _semantic_cache_failed
+    with _semantic_cache_build_lock:
+        if _semantic_cache is None and not _semantic_cache_failed:
+            try:
+                _semantic_cache = SemanticCache(
+                    SEMANTIC_CACHE_MODEL, SEMANTIC_CACHE_TTL_SECONDS, SEMANTIC_CACHE_MAX_ENTRIES
+                )
+                logger.info("Semantic cache ready (model=%s)", SEMANTIC_CACHE_MODEL)
+            except Exception as e:
+                logger.warning("Semantic cache disabled: %s", e)
+                _semantic_cache_failed = True
+    return _semantic_cache
+
+async def get_semantic_cache(enabled: bool) -> Optional[SemanticCache]:
+    """Build the semantic cache on first use; returns None when the caller's tier is disabled or dependencies are missing."""
+    if not enabled or _semantic_cache_failed:
+        return None
+    if _semantic_cache is not None:
+        return _semantic_cache
+    # Model load (or download) takes seconds; keep it off the event loop
+    return await asyncio.to_thread(build_semantic_cache)
@@ -1,41 +1,126 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from pydantic_core import to_json
 from typing import Optional
-import base64
-import io
-from PIL import Image
-from google import genai
+import asyncio
+import atexit
+import contextlib
+from cachetools import LRUCache
+import httpx
 import os
 from datetime import datetime
+import functools
+import itertools
 import logging
+import logging.handlers
+import queue
+import zlib
+
+from cache import (
+    ENHANCE_SEMANTIC_CACHE_ENABLED,
+    ENHANCE_SEMANTIC_CACHE_THRESHOLD,
+    IMAGE_STORE_ENABLED,
+    IMAGE_STORE_TTL_SECONDS,
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_THRESHOLD,
+    cache_enhancement,
+    cache_response,
+    enhance_cache_key,
+    get_cached_enhancement,
+    get_cached_response,
+    get_semantic_cache,
+    get_stored_image,
+    hash_api_key,
+    response_cache_key,
+    store_image,
+)
+
+# pybase64 dispatches to SIMD (SSSE3/AVX2/AVX-512/NEON) kernels; the stdlib module is API-compatible
+try:
+    import pybase64 as b64
+    from pybase64 import b64encode_as_string
+except ImportError:
+    import base64 as b64
+
+    def b64encode_as_string(data: bytes) -> str:
+        return b64.b64encode(data).decode("ascii")
+
+# Responses are serialized straight to JSON bytes by pydantic-core (FastAPI >= 0.130) because every
+# route declares a response_model; setting a custom response_class would disable that fast path.
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_gemini_clients()
 
-app = FastAPI(title="The Banana Board Backend")
+app = FastAPI(title="The Banana Board Backend", lifespan=lifespan)
 
 # Logging configuration
+# Records are handed to a QueueListener thread so formatting and stream writes stay off the event loop.
+# LOG_LEVEL=WARNING drops the per-request INFO lines entirely in production; per-part detail is DEBUG
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
 logger = logging.getLogger("circuit_designer")
 if not logger.handlers:
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    _log_queue = queue.SimpleQueue()
+    _stream_handler = logging.StreamHandler()
+    _stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    _log_listener = logging.handlers.QueueListener(_log_queue, _stream_handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    # The QueueHandler only merges args into the message; the stream handler applies the real format
+    logging.basicConfig(
+        level=LOG_LEVEL, format="%(message)s", handlers=[logging.handlers.QueueHandler(_log_queue)]
+    )
 logger.info("Backend starting up")
+if hasattr(b64, "get_version"):
+    # e.g. "1.4.0 (C extension active - AVX2)"
+    logger.info("pybase64 %s", b64.get_version())
+else:
+    logger.info("pybase64 not installed; using stdlib base64")
 
 # CORS configuration
+# During development and across multiple deploy URLs, a permissive CORS avoids preflight failures.
+# Set CORS_ALLOW_ORIGINS to a comma-separated list (e.g. "http://localhost:5173,https://app.example.com") to lock it down.
+CORS_ALLOW_ORIGINS = [o.strip() for o in os.environ.get("CORS_ALLOW_ORIGINS", "*").split(",") if o.strip()]
 app.add_middleware(
     CORSMiddleware,
-    # During development and across multiple deploy URLs, a permissive CORS avoids preflight failures.
-    # If you need to lock this down later, replace with explicit origins for localhost and your prod domains.
-    allow_origins=["*"],
+    allow_origins=CORS_ALLOW_ORIGINS,
     allow_credentials=False,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # The frontend only sends JSON GET/POST requests, so a fixed list keeps preflight checks cheap
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type"],
+    # Let browsers cache preflight results (they may clamp this lower, e.g. Chrome caps it at 2h)
+    max_age=86400,
 )
 
+# Base64 data URLs are plain ASCII, so gzip wins back most of the 33% encoding overhead on the wire.
+# Level 4 keeps the CPU cost low. Starlette never compresses text/event-stream, so this covers the JSON
+# bodies (response-cache hits and /enhance-prompt); design/selective event streams are compressed per
+# event by image_event_response instead.
+app.add_middleware(GZipMiddleware, minimum_size=4096, compresslevel=4)
+
+# Upper bound on base64 image payloads (characters), checked before any decode work.
+# 20M characters is roughly a 15 MB image.
+MAX_B64_LEN = int(os.environ.get("MAX_B64_LEN", str(20 * 1024 * 1024)))
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    """Return validation errors without echoing the offending input back (it may be a 20 MB image)."""
+    errors = [{k: v for k, v in err.items() if k != "input"} for err in exc.errors()]
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
+
 # Pydantic models
 class CircuitGenerationRequest(BaseModel):
     prompt: str
-    current_image: Optional[str] = None
-    painted_image: Optional[str] = None  # optional overlay/mask as base64 data URL
+    current_image: Optional[str] = Field(None, max_length=MAX_B64_LEN)
+    painted_image: Optional[str] = Field(None, max_length=MAX_B64_LEN)  # optional overlay/mask as base64 data URL
     mode: str = "design"  # "design" or "chat"
     api_key: str
+    no_cache: bool = False  # bypass response caches for this request
 
 class CircuitGenerationResponse(BaseModel):
     text: Optional[str] = None
@@ -46,63 +131,229 @@ class CircuitGenerationResponse(BaseModel):
 class PromptEnhancementRequest(BaseModel):
     prompt: str
     api_key: str
+    no_cache: bool = False  # bypass response caches for this request
 
 class PromptEnhancementResponse(BaseModel):
     enhanced_prompt: str
     success: bool = True
     error: Optional[str] = None
 
+# Static prompt text, built once at import; handlers only append the user's prompt.
+# Enhanced design instruction based on Gemini best practices for circuit generation
+DESIGN_INSTRUCTION = (
+    "Create a detailed, professional electronic circuit schematic with the following specifications:\n"
+    "- Use standard IEEE/IEC electronic symbols for all components\n"
+    "- Include clear component labels with values (resistors in ohms, capacitors in farads, etc.)\n"
+    "- Show proper wire routing with minimal crossovers\n"
+    "- Add connection points and node labels where appropriate\n"
+    "- Include power supply connections (+V, GND) clearly marked\n"
+    "- Use a clean, technical drawing style suitable for students and hobbyists\n"
+    "- Ensure the circuit is buildable and follows electrical engineering best practices\n\n"
+)
+
+CHAT_PROMPT_PREFIX = (
+    "You are an expert electronics engineer and educator. "
+    "Answer this question about electronics, circuits, or related topics: "
+)
+CHAT_PROMPT_SUFFIX = (
+    "\n\nProvide helpful, accurate, and educational responses. Include practical tips, "
+    "component recommendations, and safety considerations when relevant."
+)
+
+# UPDATED Inpainting instruction (more prescriptive guardrails)
+SELECTIVE_EDIT_INSTRUCTION = (
+    "Edit only the painted/masked region. You are a professional electronics drafting assistant performing a "
+    "precise inpainting edit on a technical circuit diagram. Follow these strict rules:\n"
+    "- CHANGE SCOPE: Modify pixels only inside the provided overlay mask. Do NOT alter or move any elements outside the mask.\n"
+    "- STYLE: Preserve the original schematic style (default to clean vector-style schematic: white background, black 1px/1pt lines, Helvetica-like labels). Match existing line weights, font size, alignment, and stroke caps.\n"
+    "- SYMBOLS & LABELS: Use standard IEEE/IEC schematic symbols. If a component is replaced or its value changed, update the label text (e.g., \"BAT1 9VDC\" -> \"BAT1 12VDC\") positioned where the original label was located. Do NOT rename node identifiers unless explicitly requested.\n"
+    "- ROUTING: Maintain orthogonal routing and wire junction conventions. Snap new wires to the existing grid so they remain orthogonal; avoid diagonal wires. Avoid creating unnecessary crossovers.\n"
+    "- COMPONENTS: Do not add new components other than those explicitly requested in the user's edit prompt. If the user requests adding a component, place it cleanly on-grid and add a single-line label with value.\n"
+    "- IMAGE OUTPUT: Return only the edited image (same format as input: PNG if input raster, SVG if input vector). Do not return explanatory text. Preserve original image resolution and DPI. Blend edges to avoid visible seams and keep antialiasing consistent.\n"
+    "- SAFETY & VALIDATION: If the requested edit would create an obviously unsafe or invalid circuit (shorts, missing ground reference when required, or reversed polarity on polarized components), instead do NOT apply the edit and return a concise one-line text response explaining the conflict.\n\n"
+    "User edit instruction: "
+)
+
+# UPDATED Prompt Enhancement instruction
+# This requests a single MEDIUM-LENGTH enhanced prompt and provides tight guardrails.
+ENHANCEMENT_INSTRUCTION = """
+You are an expert electronics engineer and professional prompt-writer for image-generation models.
+Produce exactly ONE enhanced, MEDIUM-LENGTH image-generation prompt (2-4 sentences, ~40-120 words) optimized for generating a clean, buildable circuit schematic or a photorealistic top-down wiring photo depending on the user's original intention.
+
+Requirements & guardrails:
+- Output only the enhanced prompt text; do not include extra headings, explanations, or JSON.
+- If the original prompt implies a schematic (words like 'diagram', 'schematic', 'symbols'), default to: "clean vector schematic, white background, black 1px lines, Helvetica-like labels, standard IEEE/IEC symbols, SVG output, aspect ratio 4:3".
+- If the original prompt implies realism (words like 'real life', 'photo', 'top view', 'photorealistic'), default to: "photorealistic top-down wiring photo, neutral diffuse lighting, minimal shadows, high detail, show components mounted on a bench or PCB as appropriate, include camera/lens suggestions (e.g., 50mm equivalent, top-down), PNG output".
+- Always include a reasonable safe default for unspecified voltages/values: use 9V for single-cell battery examples, and suggest a 220Ω resistor for basic LED protection if an LED is present. If the prompt mentions a specific value, keep it unchanged.
+- Be explicit about wiring order and connectivity (e.g., "battery positive → switch → lamp → battery negative") and include node labels if relevant (NODE_A, NODE_B).
+- Include one-line safety guidance in the prompt when the design could be unsafe (e.g., "include series resistor to limit current for LEDs; ensure correct polarity for electrolytics").
+- Add a negative-style clause to avoid unwanted styles: "no perspective distortion, no color gradients in wires, no decorative backgrounds, no handwritten text".
+- Prefer vector/SVG for schematics and PNG for photorealistic renders; mention the recommended output format.
+- Keep the language precise and actionable for an image generator (avoid open-ended questions).
+
+Original prompt: {original_prompt}
+
+Enhanced prompt:
+"""
+# Split once so the handler concatenates instead of running str.format over the whole template
+ENHANCEMENT_PREFIX, ENHANCEMENT_SUFFIX = ENHANCEMENT_INSTRUCTION.split("{original_prompt}")
+
 # Configure Gemini AI client
+# One async HTTP pool per event loop is shared by every per-key client on it, so keep-alive connections
+# to the Gemini endpoint are reused across users. Pooled connections belong to the loop that opened
+# them, so a host that runs requests on a fresh loop gets a fresh pool rather than dead connections.
+# The SDK sends the API key and timeout per request.
+GEMINI_CLIENTS_PER_LOOP = 128
+# event loop -> (httpx.AsyncClient, LRUCache of api_key -> genai.Client)
+_gemini_pools = {}
+
+# google.genai takes ~250 ms to import, so it is loaded by the first Gemini request rather than at
+# cold start; /health and CORS preflights never pay for it.
+@functools.lru_cache(maxsize=None)
+def genai_types():
+    from google.genai import types
+
+    return types
+
+# Clients are reused per API key so SDK setup isn't repeated on every request. Each SDK client also
+# holds an async transport, so clients are cached per loop together with the pool.
 def get_gemini_client(api_key: str):
-    return genai.Client(api_key=api_key)
+    loop = asyncio.get_running_loop()
+    pool = _gemini_pools.get(loop)
+    if pool is None:
+        # Pools of loops that have since closed can never be used again
+        for stale_loop in [l for l in _gemini_pools if l.is_closed()]:
+            del _gemini_pools[stale_loop]
+        pool = _gemini_pools[loop] = (httpx.AsyncClient(timeout=None), LRUCache(maxsize=GEMINI_CLIENTS_PER_LOOP))
+    http_client, clients = pool
+    client = clients.get(api_key)
+    if client is None:
+        from google import genai
+
+        client = genai.Client(api_key=api_key, http_options={"httpx_async_client": http_client})
+        clients[api_key] = client
+    return client
+
+async def close_gemini_clients() -> None:
+    """Close the HTTP pool of the running loop; called on application shutdown."""
+    pool = _gemini_pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool[0].aclose()
+
+def friendly_error_message(e: Exception) -> str:
+    """Map common Gemini errors to messages the UI can show directly."""
+    error_message = str(e)
+    if "API_KEY" in error_message:
+        error_message = "Invalid API key. Please check your Gemini API key."
+    elif "quota" in error_message.lower():
+        error_message = "API quota exceeded. Please check your Gemini API usage."
+    return error_message
+
+def sse_event(payload: dict) -> bytes:
+    # pydantic-core's Rust encoder, like the JSON responses; ~3x faster than json.dumps on multi-MB image events
+    return b"data: " + to_json(payload) + b"\n\n"
+
+# Events above this size (in practice only the image_url event) are compressed in a worker thread
+SSE_GZIP_THREAD_MIN = 64 * 1024
+
+def _gzip_event(compressor, event: bytes) -> bytes:
+    # Z_SYNC_FLUSH ends the output on a byte boundary, so the browser can decode the event right away
+    return compressor.compress(event) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+async def gzip_event_stream(events):
+    """Gzip an SSE byte stream, flushing after every event so text deltas still arrive as they're generated."""
+    compressor = zlib.compressobj(4, zlib.DEFLATED, 31)  # wbits=31: gzip container, matching GZipMiddleware's level
+    async for event in events:
+        if len(event) >= SSE_GZIP_THREAD_MIN:
+            yield await asyncio.to_thread(_gzip_event, compressor, event)
+        else:
+            yield _gzip_event(compressor, event)
+    yield compressor.flush()
+
+def image_event_response(events, http_request: Request) -> StreamingResponse:
+    """Stream image-generation events, gzipped when the client accepts it."""
+    if "gzip" in http_request.headers.get("accept-encoding", "").lower():
+        return StreamingResponse(
+            gzip_event_stream(events),
+            media_type="text/event-stream",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+        )
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Vary": "Accept-Encoding"})
 
-def image_to_base64(image_data: bytes, mime_type: str = "image/png") -> str:
-    """Convert image bytes to base64 data URL with provided MIME type"""
-    safe_mime = mime_type if mime_type.startswith("image/") else "image/png"
-    return f"data:{safe_mime};base64,{base64.b64encode(image_data).decode()}"
+# "data:image/svg+xml;base64," is the longest header we expect; leave room for parameters
+DATA_URL_HEADER_MAX = 64
 
-def base64_to_image(base64_string: str) -> Image.Image:
-    """Convert base64 data URL to PIL Image"""
-    if base64_string.startswith("data:image"):
-        base64_string = base64_string.split(",")[1]
-    
-    image_data = base64.b64decode(base64_string)
-    return Image.open(io.BytesIO(image_data))
+def strip_data_url_header(data_url: str) -> str:
+    """Drop a "data:...;base64," prefix, looking for the comma only within the header."""
+    if data_url.startswith("data:"):
+        comma = data_url.find(",", 5, DATA_URL_HEADER_MAX)
+        if comma != -1:
+            return data_url[comma + 1:]
+    return data_url
 
 def data_url_to_bytes(data_url: str) -> bytes:
     """Convert a base64 data URL or bare base64 string to bytes."""
-    if data_url.startswith("data:"):
-        try:
-            data_url = data_url.split(",", 1)[1]
-        except Exception:
-            pass
+    data_url = strip_data_url_header(data_url)
     try:
-        return base64.b64decode(data_url, validate=False)
+        return b64.b64decode(data_url, validate=False)
     except Exception:
         # As a last resort, try interpreting as raw bytes string
         return data_url.encode()
 
-# Best-effort MIME detection from image magic numbers
+# Best-effort MIME detection from image magic numbers.
+# Most formats are identified by their first four bytes, so detection is one dict lookup.
+_MAGIC4 = {
+    b"\x89PNG": "image/png",
+    b"GIF8": "image/gif",
+    b"II*\x00": "image/tiff",
+    b"MM\x00*": "image/tiff",
+    b"<svg": "image/svg+xml",
+    b"<?xm": "image/svg+xml",
+}
+# ISO-BMFF major brands (bytes 8-12, after the box size and "ftyp")
+_FTYP_BRANDS = {
+    b"heic": "image/heic", b"heix": "image/heic", b"hevc": "image/heic",
+    b"hevx": "image/heic", b"heim": "image/heic", b"heis": "image/heic",
+    b"mif1": "image/heif", b"msf1": "image/heif",
+    b"avif": "image/avif", b"avis": "image/avif",
+}
+
+def sniff_image_mime(image_bytes: bytes) -> Optional[str]:
+    """Return the image MIME type implied by the leading magic bytes, or None if unrecognised."""
+    # Only the header matters: slice first so whitespace stripping never copies the whole buffer
+    b = bytes(image_bytes[:32]).lstrip()
+    head = b[:4]
+    mime = _MAGIC4.get(head)
+    if mime is not None:
+        return mime
+    if head[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if head == b"RIFF":
+        return "image/webp" if b[8:12] == b"WEBP" else None
+    if b[4:8] == b"ftyp":
+        return _FTYP_BRANDS.get(b[8:12])
+    if head[:2] == b"BM":
+        return "image/bmp"
+    return None
+
 def detect_image_mime(image_bytes: bytes, fallback: str = "image/png") -> str:
-    b = image_bytes.lstrip()
+    mime = sniff_image_mime(image_bytes)
+    if mime is not None:
+        return mime
+    return fallback if isinstance(fallback, str) and fallback.startswith("image/") else "image/png"
+
+def sniff_base64_mime(b64_text) -> Optional[str]:
+    """Sniff the MIME type of base64-encoded image data (str or ASCII bytes) by decoding only its first few bytes."""
+    # Slice before stripping so leading whitespace never copies the whole payload
+    head = b64_text[:64].lstrip()[:24]
     try:
-        if b.startswith(b"\x89PNG\r\n\x1a\n"):
-            return "image/png"
-        if b.startswith(b"\xff\xd8"):
-            return "image/jpeg"
-        if b.startswith(b"GIF8"):
-            return "image/gif"
-        if b.startswith(b"BM"):
-            return "image/bmp"
-        if (b.startswith(b"II*\x00") or b.startswith(b"MM\x00*")):
-            return "image/tiff"
-        if b.startswith(b"RIFF") and b[8:12] == b"WEBP":
-            return "image/webp"
-        if b.startswith(b"<svg") or b.startswith(b"<?xml"):
-            return "image/svg+xml"
+        return sniff_image_mime(b64.b64decode(head, validate=False))
     except Exception:
-        pass
-    return fallback if isinstance(fallback, str) and fallback.startswith("image/") else "image/png"
+        return None
+
+def detect_base64_mime(b64_text, fallback: str = "image/png") -> str:
+    mime = sniff_base64_mime(b64_text)
+    return mime if mime is not None else fallback
 
 # Temporary output directory for saving images
 # NOTE: Vercel serverless has a read-only filesystem except for /tmp
@@ -110,49 +361,166 @@ OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "/tmp/generated_images")
 try:
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 except Exception as e:
-    logger.warning(f"Could not create OUTPUT_DIR {OUTPUT_DIR}: {e}. Falling back to /tmp")
+    logger.warning("Could not create OUTPUT_DIR %s: %s. Falling back to /tmp", OUTPUT_DIR, e)
     OUTPUT_DIR = "/tmp"
 
-def save_pil_image(img: Image.Image, prefix: str = "output") -> str:
-    ts = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
-    path = os.path.join(OUTPUT_DIR, f"{prefix}-{ts}.png")
+# Debug copies of input/output images cost a disk write per request, so they are only written
+# when explicitly enabled.
+SAVE_DEBUG_IMAGES = os.environ.get("SAVE_DEBUG_IMAGES", "0") == "1"
+
+# Debug filenames: one timestamp per process plus a counter, instead of strftime on every save
+_RUN_ID = datetime.now().strftime("%Y%m%d-%H%M%S")
+_save_seq = itertools.count()
+
+def save_raw_image(image_bytes: bytes, mime_type: str = "image/png", prefix: str = "output") -> Optional[str]:
+    """Write already-encoded image bytes as-is, skipping a PIL decode/re-encode."""
+    if not SAVE_DEBUG_IMAGES:
+        return None
+    # image/png -> .png, image/svg+xml -> .svg
+    ext = mime_type.partition("/")[2].partition("+")[0] or "png"
+    path = os.path.join(OUTPUT_DIR, f"{prefix}-{_RUN_ID}-{next(_save_seq)}.{ext}")
     try:
-        img.save(path)
-        logger.info(f"Saved image -> {path}")
+        with open(path, "wb") as f:
+            f.write(image_bytes)
+        logger.info("Saved image bytes -> %s", path)
     except Exception as e:
-        logger.error(f"Failed to save image {path}: {e}")
+        logger.error("Failed to save image bytes %s: %s", path, e)
     return path
 
+def save_base64_image(b64_text: str, prefix: str = "output") -> Optional[str]:
+    """Decode and save base64 image text; meant to run as a background task so the decode is off the request path."""
+    if not SAVE_DEBUG_IMAGES:
+        return None
+    image_bytes = data_url_to_bytes(b64_text)
+    return save_raw_image(image_bytes, detect_image_mime(image_bytes), prefix)
+
+def inline_data_to_url(inline_data, background_tasks: BackgroundTasks) -> str:
+    """Turn a Gemini inline_data part into a browser-safe image URL (a data URL, or /img/{token} when the image store is on)."""
+    image_data = inline_data.data
+    mime_type = inline_data.mime_type or "image/png"
+
+    # Gemini may return inline_data.data as base64-encoded ASCII or as raw image bytes.
+    # Base64 text delivered as bytes is handled like the str case
+    if (
+        isinstance(image_data, (bytes, bytearray))
+        and sniff_image_mime(image_data) is None
+        and sniff_base64_mime(image_data) is not None
+    ):
+        image_data = image_data.decode("ascii")
+
+    if isinstance(image_data, str):
+        # Already base64 text: splice it into the data URL without a decode/re-encode
+        real_mime = detect_base64_mime(image_data, mime_type)
+        if SAVE_DEBUG_IMAGES:
+            background_tasks.add_task(save_base64_image, image_data, "output")
+        return f"data:{real_mime};base64,{image_data}"
+
+    # Raw image bytes are used as-is; only the data URL needs encoding
+    # Any other buffer type is viewed rather than copied; every consumer below accepts the buffer protocol
+    image_bytes = image_data if isinstance(image_data, (bytes, bytearray)) else memoryview(image_data)
+
+    # Correct the MIME type based on the actual bytes to avoid browser decode failures
+    real_mime = detect_image_mime(image_bytes, mime_type)
+    if real_mime != mime_type:
+        logger.info("MIME corrected: model=%s detected=%s", mime_type, real_mime)
+
+    # Save the model output for debugging after the response has been sent
+    if SAVE_DEBUG_IMAGES:
+        background_tasks.add_task(save_raw_image, image_bytes, real_mime, "output")
+
+    if IMAGE_STORE_ENABLED:
+        image_path = store_image(image_bytes, real_mime)
+        if image_path is not None:
+            logger.info("Stored image: %s, size: %s bytes", real_mime, len(image_bytes))
+            return image_path
+
+    b64_data = b64encode_as_string(image_bytes)
+    logger.info("Created base64 data URL: %s, size: %s bytes", real_mime, len(image_bytes))
+    return f"data:{real_mime};base64,{b64_data}"
+
+async def stream_image_generation(
+    chunks, background_tasks: BackgroundTasks, label: str, response_key: Optional[str] = None
+):
+    """Relay a Gemini image-model stream as Server-Sent Events.
+
+    Events are {"text": delta} as text arrives, {"image_url": data_url} once the image part is
+    complete, then {"done": true}, or {"error": message} on failure. Compression, if any, is left
+    to image_event_response.
+    """
+    text_parts = []
+    image_b64_url = None
+    part_count = 0
+    log_parts = logger.isEnabledFor(logging.DEBUG)
+    try:
+        async for chunk in chunks:
+            if not chunk.candidates or chunk.candidates[0].content is None:
+                continue
+            for part in chunk.candidates[0].content.parts or ():
+                if part.text is not None:
+                    if log_parts:
+                        logger.debug("part[%s] type=text len=%s", part_count, len(part.text))
+                    text_parts.append(part.text)
+                    yield sse_event({"text": part.text})
+                elif part.inline_data is not None:
+                    if log_parts:
+                        logger.debug("part[%s] type=inline_data mime=%s", part_count, part.inline_data.mime_type)
+                    image_b64_url = await asyncio.to_thread(inline_data_to_url, part.inline_data, background_tasks)
+                    yield sse_event({"image_url": image_b64_url})
+                part_count += 1
+    except Exception as e:
+        logger.error("%s stream failed: %s", label, e)
+        yield sse_event({"error": friendly_error_message(e)})
+        return
+
+    logger.info("Model returned %s part(s) in %s", part_count, label)
+    # Only cache complete results. A text-only reply is usually a refusal or a transient failure, and an
+    # /img/{token} URL can be evicted from the image store while the cached response still points to it
+    if response_key is not None and image_b64_url is not None and image_b64_url.startswith("data:"):
+        cache_response(
+            response_key,
+            CircuitGenerationResponse(
+                text="".join(text_parts) or "Generated circuit diagram",
+                image_url=image_b64_url,
+                success=True,
+            ),
+        )
+    yield sse_event({"done": True})
+
 @app.post("/generate-circuit", response_model=CircuitGenerationResponse)
-async def generate_circuit(request: CircuitGenerationRequest):
+async def generate_circuit(
+    request: CircuitGenerationRequest,
+    background_tasks: BackgroundTasks,
+    http_request: Request,
+    nocache: bool = False,
+):
     try:
         client = get_gemini_client(request.api_key)
         logger.info(
-            f"/generate-circuit mode={request.mode} prompt_len={len(request.prompt)} has_image={bool(request.current_image)}"
+            "/generate-circuit mode=%s prompt_len=%s has_image=%s", request.mode, len(request.prompt), bool(request.current_image)
         )
+
+        # Identical requests (UI retries, repeated demos) are answered without calling Gemini
+        use_response_cache = not (nocache or request.no_cache)
+        if use_response_cache:
+            # Hashing and base64 work on multi-MB payloads runs in worker threads (pybase64 and hashlib
+            # release the GIL), so the event loop stays free for other requests
+            response_key = await asyncio.to_thread(response_cache_key, request)
+            cached_response = get_cached_response(response_key)
+            if cached_response is not None:
+                logger.info("Response cache hit")
+                return cached_response
         
         # Selective edit path (always image output)
         is_selective = bool(request.painted_image) and bool(request.current_image)
         if is_selective:
-            from google.genai import types
-
-            # UPDATED Inpainting instruction (more prescriptive guardrails)
-            instr = (
-                "Edit only the painted/masked region. You are a professional electronics drafting assistant performing a "
-                "precise inpainting edit on a technical circuit diagram. Follow these strict rules:\n"
-                "- CHANGE SCOPE: Modify pixels only inside the provided overlay mask. Do NOT alter or move any elements outside the mask.\n"
-                "- STYLE: Preserve the original schematic style (default to clean vector-style schematic: white background, black 1px/1pt lines, Helvetica-like labels). Match existing line weights, font size, alignment, and stroke caps.\n"
-                "- SYMBOLS & LABELS: Use standard IEEE/IEC schematic symbols. If a component is replaced or its value changed, update the label text (e.g., \"BAT1 9VDC\" -> \"BAT1 12VDC\") positioned where the original label was located. Do NOT rename node identifiers unless explicitly requested.\n"
-                "- ROUTING: Maintain orthogonal routing and wire junction conventions. Snap new wires to the existing grid so they remain orthogonal; avoid diagonal wires. Avoid creating unnecessary crossovers.\n"
-                "- COMPONENTS: Do not add new components other than those explicitly requested in the user's edit prompt. If the user requests adding a component, place it cleanly on-grid and add a single-line label with value.\n"
-                "- IMAGE OUTPUT: Return only the edited image (same format as input: PNG if input raster, SVG if input vector). Do not return explanatory text. Preserve original image resolution and DPI. Blend edges to avoid visible seams and keep antialiasing consistent.\n"
-                "- SAFETY & VALIDATION: If the requested edit would create an obviously unsafe or invalid circuit (shorts, missing ground reference when required, or reversed polarity on polarized components), instead do NOT apply the edit and return a concise one-line text response explaining the conflict.\n\n"
-                f"User edit instruction: {request.prompt}"
-            )
+            instr = SELECTIVE_EDIT_INSTRUCTION + request.prompt
 
             try:
-                base_bytes = data_url_to_bytes(request.current_image)
-                overlay_bytes = data_url_to_bytes(request.painted_image)
+                # The two payloads are independent, so decode them on two worker threads at once
+                base_bytes, overlay_bytes = await asyncio.gather(
+                    asyncio.to_thread(data_url_to_bytes, request.current_image),
+                    asyncio.to_thread(data_url_to_bytes, request.painted_image),
+                )
 
                 base_mime = detect_image_mime(base_bytes, "image/png")
                 # Overlay is always a transparent PNG from the UI
@@ -160,300 +528,214 @@ async def generate_circuit(request: CircuitGenerationRequest):
 
                 contents = [
                     instr,
-                    types.Part.from_bytes(data=base_bytes, mime_type=base_mime),
-                    types.Part.from_bytes(data=overlay_bytes, mime_type=overlay_mime),
+                    genai_types().Part.from_bytes(data=base_bytes, mime_type=base_mime),
+                    genai_types().Part.from_bytes(data=overlay_bytes, mime_type=overlay_mime),
                 ]
 
                 logger.info(
-                    f"Selective edit: base_mime={base_mime} base_size={len(base_bytes)} overlay_size={len(overlay_bytes)}"
+                    "Selective edit: base_mime=%s base_size=%s overlay_size=%s", base_mime, len(base_bytes), len(overlay_bytes)
                 )
 
-                response = client.models.generate_content(
+                stream = await client.aio.models.generate_content_stream(
                     model="gemini-2.5-flash-image-preview",
                     contents=contents,
                 )
-
-                # Extract image as in design path below
-                text_response = ""
-                image_b64_url = None
-                parts = response.candidates[0].content.parts
-                logger.info(f"Model returned {len(parts)} part(s) in selective edit")
-                for idx, part in enumerate(parts):
-                    if part.text is not None:
-                        logger.info(f"part[{idx}] type=text len={len(part.text)}")
-                        text_response += part.text
-                    elif part.inline_data is not None:
-                        logger.info(f"part[{idx}] type=inline_data mime={part.inline_data.mime_type}")
-                        image_data = part.inline_data.data
-                        mime_type = part.inline_data.mime_type or "image/png"
-
-                        image_bytes = None
-                        try:
-                            b = image_data if isinstance(image_data, (bytes, bytearray)) else str(image_data).encode('utf-8')
-                            decoded = base64.b64decode(b, validate=False)
-                            if (
-                                decoded.startswith(b"\x89PNG\r\n\x1a\n")
-                                or decoded.startswith(b"\xff\xd8")
-                                or decoded.startswith(b"RIFF")
-                                or decoded.startswith(b"GIF8")
-                            ):
-                                image_bytes = decoded
-                        except Exception:
-                            pass
-                        if image_bytes is None:
-                            image_bytes = image_data if isinstance(image_data, (bytes, bytearray)) else bytes(image_data)
-
-                        real_mime = detect_image_mime(image_bytes, mime_type)
-                        if real_mime != mime_type:
-                            logger.info(f"MIME corrected: model={mime_type} detected={real_mime}")
-                        b64_data = base64.b64encode(image_bytes).decode()
-                        image_b64_url = f"data:{real_mime};base64,{b64_data}"
-                        logger.info(f"Created base64 data URL: {real_mime}, size: {len(image_bytes)} bytes")
-
-                        try:
-                            img = Image.open(io.BytesIO(image_bytes))
-                            save_pil_image(img, prefix="output")
-                            logger.info(f"Successfully saved PIL image: {img.size}")
-                        except Exception as e:
-                            logger.warning(f"Could not save as PIL image (this is OK): {e}")
-                return CircuitGenerationResponse(
-                    text=text_response or "Generated circuit diagram",
-                    image_url=image_b64_url,
-                    success=True,
+                return image_event_response(
+                    stream_image_generation(
+                        stream, background_tasks, "Selective edit", response_key if use_response_cache else None
+                    ),
+                    http_request,
                 )
             except Exception as e:
-                logger.error(f"Selective edit failed: {e}")
+                logger.error("Selective edit failed: %s", e)
                 raise
 
         if request.mode == "design":
             # Use Gemini 2.5 Flash Image Preview for design generation
-            # Enhanced instruction based on Gemini best practices for circuit generation
-            instruction = (
-                "Create a detailed, professional electronic circuit schematic with the following specifications:\n"
-                "- Use standard IEEE/IEC electronic symbols for all components\n"
-                "- Include clear component labels with values (resistors in ohms, capacitors in farads, etc.)\n                "
-                "- Show proper wire routing with minimal crossovers\n"
-                "- Add connection points and node labels where appropriate\n"
-                "- Include power supply connections (+V, GND) clearly marked\n"
-                "- Use a clean, technical drawing style suitable for students and hobbyists\n"
-                "- Ensure the circuit is buildable and follows electrical engineering best practices\n\n"
-            )
 
-            contents = []
+            # Send the uploaded image as its original compressed bytes; Gemini doesn't need a PIL decode
+            image_part = None
             if request.current_image:
                 try:
-                    current_img = base64_to_image(request.current_image)
-                    # Save input image for debugging
-                    save_pil_image(current_img, prefix="input")
-                    contents.append(current_img)
-                    contents.append(
-                        f"{instruction}Update this circuit based on: {request.prompt}"
-                    )
-                except Exception as e:
-                    print(f"Error processing current image: {e}")
-                    # Fallback to text-only if image fails to decode
-                    contents = [
-                        (
-                            "Create a detailed electronic circuit schematic based on this description: "
-                            f"{request.prompt}\n\n{instruction}"
-                        )
-                    ]
+                    current_bytes = await asyncio.to_thread(data_url_to_bytes, request.current_image)
+                    current_mime = detect_image_mime(current_bytes, "image/png")
+                    image_part = genai_types().Part.from_bytes(data=current_bytes, mime_type=current_mime)
+                    # Save the uploaded bytes for debugging; no need to re-encode through PIL
+                    if SAVE_DEBUG_IMAGES:
+                        background_tasks.add_task(save_raw_image, current_bytes, current_mime, "input")
+                except Exception:
+                    logger.exception("Error processing current image")
+                    # Fallback to text-only if the image can't be read
+                    image_part = None
+
+            if image_part is not None:
+                contents = [image_part, f"{DESIGN_INSTRUCTION}Update this circuit based on: {request.prompt}"]
             else:
                 # Text-only generation when there's no base image
                 contents = [
                     (
                         "Create a detailed electronic circuit schematic based on this description: "
-                        f"{request.prompt}\n\n{instruction}"
+                        f"{request.prompt}\n\n{DESIGN_INSTRUCTION}"
                     )
                 ]
 
-            response = client.models.generate_content(
+            stream = await client.aio.models.generate_content_stream(
                 model="gemini-2.5-flash-image-preview",
                 contents=contents,
             )
-
-            # Extract text and image from response - Fixed based on Gemini docs
-            text_response = ""
-            image_b64_url = None
-            
-            parts = response.candidates[0].content.parts
-            logger.info(f"Model returned {len(parts)} part(s) in design mode")
-            
-            for idx, part in enumerate(parts):
-                if part.text is not None:
-                    logger.info(f"part[{idx}] type=text len={len(part.text)}")
-                    text_response += part.text
-                elif part.inline_data is not None:
-                    logger.info(f"part[{idx}] type=inline_data mime={part.inline_data.mime_type}")
-                    # Get the raw image data
-                    image_data = part.inline_data.data
-                    mime_type = part.inline_data.mime_type or "image/png"
-
-                    # Gemini may return inline_data.data as base64-encoded ASCII or as raw image bytes.
-                    # If it's base64 text (e.g., starts with iVBOR... or /9j/), decode it first.
-                    image_bytes = None
-                    try:
-                        # Ensure we have bytes to attempt base64 decode
-                        b = image_data if isinstance(image_data, (bytes, bytearray)) else str(image_data).encode('utf-8')
-                        # Use validate=False to tolerate newlines/whitespace sometimes present in SDK output
-                        decoded = base64.b64decode(b, validate=False)
-                        # Check for common image magic numbers after decoding
-                        if (
-                            decoded.startswith(b"\x89PNG\r\n\x1a\n")  # PNG
-                            or decoded.startswith(b"\xff\xd8")          # JPEG
-                            or decoded.startswith(b"RIFF")                 # WebP/AVI container
-                            or decoded.startswith(b"GIF8")                 # GIF
-                        ):
-                            image_bytes = decoded
-                            logger.info("inline_data appears to be base64 text; successfully decoded to raw image bytes")
-                    except Exception:
-                        # Not valid base64 text; fall back to original
-                        pass
-
-                    if image_bytes is None:
-                        # Treat original as raw bytes
-                        image_bytes = image_data if isinstance(image_data, (bytes, bytearray)) else bytes(image_data)
-
-                    # Correct the MIME type based on the actual bytes to avoid browser decode failures
-                    real_mime = detect_image_mime(image_bytes, mime_type)
-                    if real_mime != mime_type:
-                        logger.info(f"MIME corrected: model={mime_type} detected={real_mime}")
-                    # Create base64 data URL from actual image bytes
-                    b64_data = base64.b64encode(image_bytes).decode()
-                    image_b64_url = f"data:{real_mime};base64,{b64_data}"
-                    logger.info(f"Created base64 data URL: {mime_type}, size: {len(image_bytes)} bytes")
-
-                    # Try to save as PIL image for debugging (optional, don't fail if this doesn't work)
-                    try:
-                        img = Image.open(io.BytesIO(image_bytes))
-                        save_pil_image(img, prefix="output")
-                        logger.info(f"Successfully saved PIL image: {img.size}")
-                    except Exception as e:
-                        logger.warning(f"Could not save as PIL image (this is OK): {e}")
-                        # Save raw bytes as fallback for debugging
-                        try:
-                            ts = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
-                            raw_path = os.path.join(OUTPUT_DIR, f"output-raw-{ts}.bin")
-                            with open(raw_path, 'wb') as f:
-                                f.write(image_bytes)
-                            logger.info(f"Saved raw image bytes -> {raw_path}")
-                        except Exception as e2:
-                            logger.error(f"Failed to save raw bytes: {e2}")
-
-            return CircuitGenerationResponse(
-                text=text_response or "Generated circuit diagram",
-                image_url=image_b64_url,
-                success=True,
+            return image_event_response(
+                stream_image_generation(
+                    stream, background_tasks, "Design", response_key if use_response_cache else None
+                ),
+                http_request,
             )
             
         else:
             # Use Gemini 2.5 Flash for chat mode (text only)
             
-            chat_prompt = f"""
-            You are an expert electronics engineer and educator. Answer this question about electronics, circuits, or related topics: {request.prompt}
-            
-            Provide helpful, accurate, and educational responses. Include practical tips, component recommendations, and safety considerations when relevant.
-            """
+            chat_prompt = CHAT_PROMPT_PREFIX + request.prompt + CHAT_PROMPT_SUFFIX
             
+            # Near-duplicate questions are served from the semantic cache. Image context makes
+            # answers specific to the circuit shown, so those requests are never cached.
+            semantic_cache = None
+            if not request.current_image and use_response_cache:
+                semantic_cache = await get_semantic_cache(SEMANTIC_CACHE_ENABLED)
+            if semantic_cache is not None:
+                cache_namespace = hash_api_key(request.api_key)
+                prompt_embedding, cached_text = await asyncio.to_thread(
+                    semantic_cache.embed_and_lookup,
+                    cache_namespace,
+                    f"{request.mode}|{request.prompt}",
+                    SEMANTIC_CACHE_THRESHOLD,
+                )
+                if cached_text is not None:
+                    logger.info("Semantic cache hit in chat mode")
+                    return CircuitGenerationResponse(text=cached_text, success=True)
+
             contents = [chat_prompt]
             
-            # Add current image context if available
+            # Add current image context if available, as raw bytes (no PIL decode needed)
             if request.current_image:
                 try:
-                    current_img = base64_to_image(request.current_image)
-                    contents.append(current_img)
+                    current_bytes = await asyncio.to_thread(data_url_to_bytes, request.current_image)
+                    current_mime = detect_image_mime(current_bytes, "image/png")
+                    contents.append(genai_types().Part.from_bytes(data=current_bytes, mime_type=current_mime))
                     contents.append("This is the current circuit being discussed. Please reference it in your response if relevant.")
-                except Exception as e:
-                    print(f"Error processing current image: {e}")
-            
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=contents
-            )
-            
-            # Extract text from response
-            text_response = ""
-            for part in response.candidates[0].content.parts:
-                if part.text is not None:
-                    text_response += part.text
-            
-            return CircuitGenerationResponse(
-                text=text_response,
-                success=True
-            )
+                except Exception:
+                    logger.exception("Error processing current image")
             
+            # Stream text as Server-Sent Events so the UI can render tokens as they arrive.
+            # Events are {"text": delta}, then {"done": true}, or {"error": message} on failure.
+            async def stream_chat():
+                text_chunks = []
+                try:
+                    stream = await client.aio.models.generate_content_stream(
+                        model="gemini-2.5-flash",
+                        contents=contents
+                    )
+                    async for chunk in stream:
+                        if chunk.text:
+                            text_chunks.append(chunk.text)
+                            yield sse_event({"text": chunk.text})
+                except Exception as e:
+                    logger.error("Chat stream failed: %s", e)
+                    yield sse_event({"error": friendly_error_message(e)})
+                    return
+
+                text_response = "".join(text_chunks)
+                if use_response_cache and text_response:
+                    cache_response(response_key, CircuitGenerationResponse(text=text_response, success=True))
+                if semantic_cache is not None and text_response:
+                    await asyncio.to_thread(semantic_cache.insert, cache_namespace, prompt_embedding, text_response)
+                yield sse_event({"done": True})
+
+            return StreamingResponse(stream_chat(), media_type="text/event-stream")
+
     except Exception as e:
-        error_message = str(e)
-        if "API_KEY" in error_message:
-            error_message = "Invalid API key. Please check your Gemini API key."
-        elif "quota" in error_message.lower():
-            error_message = "API quota exceeded. Please check your Gemini API usage."
-        
         return CircuitGenerationResponse(
             success=False,
-            error=error_message
+            error=friendly_error_message(e)
         )
 
 @app.post("/enhance-prompt", response_model=PromptEnhancementResponse)
-async def enhance_prompt(request: PromptEnhancementRequest):
+async def enhance_prompt(request: PromptEnhancementRequest, nocache: bool = False):
     try:
         client = get_gemini_client(request.api_key)
-        logger.info(f"/enhance-prompt prompt_len={len(request.prompt)}")
-        
-        # UPDATED Prompt Enhancement instruction
-        # This requests a single MEDIUM-LENGTH enhanced prompt and provides tight guardrails.
-        enhancement_instruction = """
-        You are an expert electronics engineer and professional prompt-writer for image-generation models.
-        Produce exactly ONE enhanced, MEDIUM-LENGTH image-generation prompt (2-4 sentences, ~40-120 words) optimized for generating a clean, buildable circuit schematic or a photorealistic top-down wiring photo depending on the user's original intention.
-
-        Requirements & guardrails:
-        - Output only the enhanced prompt text; do not include extra headings, explanations, or JSON.
-        - If the original prompt implies a schematic (words like 'diagram', 'schematic', 'symbols'), default to: "clean vector schematic, white background, black 1px lines, Helvetica-like labels, standard IEEE/IEC symbols, SVG output, aspect ratio 4:3".
-        - If the original prompt implies realism (words like 'real life', 'photo', 'top view', 'photorealistic'), default to: "photorealistic top-down wiring photo, neutral diffuse lighting, minimal shadows, high detail, show components mounted on a bench or PCB as appropriate, include camera/lens suggestions (e.g., 50mm equivalent, top-down), PNG output".
-        - Always include a reasonable safe default for unspecified voltages/values: use 9V for single-cell battery examples, and suggest a 220Ω resistor for basic LED protection if an LED is present. If the prompt mentions a specific value, keep it unchanged.
-        - Be explicit about wiring order and connectivity (e.g., "battery positive → switch → lamp → battery negative") and include node labels if relevant (NODE_A, NODE_B).
-        - Include one-line safety guidance in the prompt when the design could be unsafe (e.g., "include series resistor to limit current for LEDs; ensure correct polarity for electrolytics").
-        - Add a negative-style clause to avoid unwanted styles: "no perspective distortion, no color gradients in wires, no decorative backgrounds, no handwritten text".
-        - Prefer vector/SVG for schematics and PNG for photorealistic renders; mention the recommended output format.
-        - Keep the language precise and actionable for an image generator (avoid open-ended questions).
-
-        Original prompt: {original_prompt}
-
-        Enhanced prompt:
-        """
-
-        response = client.models.generate_content(
+        logger.info("/enhance-prompt prompt_len=%s", len(request.prompt))
+
+        use_cache = not (nocache or request.no_cache)
+        semantic_cache = None
+        if use_cache:
+            cache_key = enhance_cache_key(request)
+            cached = get_cached_enhancement(cache_key)
+            if cached is not None:
+                logger.info("Enhance cache hit")
+                return cached
+            semantic_cache = await get_semantic_cache(ENHANCE_SEMANTIC_CACHE_ENABLED)
+        if semantic_cache is not None:
+            # Separate namespace so enhanced prompts are never served as chat answers
+            cache_namespace = hash_api_key(request.api_key) + ":enhance"
+            prompt_embedding, cached_text = await asyncio.to_thread(
+                semantic_cache.embed_and_lookup, cache_namespace, request.prompt, ENHANCE_SEMANTIC_CACHE_THRESHOLD
+            )
+            if cached_text is not None:
+                logger.info("Semantic cache hit in prompt enhancement")
+                return PromptEnhancementResponse(enhanced_prompt=cached_text, success=True)
+
+        response = await client.aio.models.generate_content(
             model="gemini-2.5-flash",
-            contents=[enhancement_instruction.format(original_prompt=request.prompt)]
+            contents=[ENHANCEMENT_PREFIX + request.prompt + ENHANCEMENT_SUFFIX]
         )
         
-        enhanced_text = ""
-        for part in response.candidates[0].content.parts:
-            if part.text is not None:
-                enhanced_text += part.text
-        
-        return PromptEnhancementResponse(
-            enhanced_prompt=enhanced_text.strip(),
+        enhanced_text = "".join(
+            part.text for part in response.candidates[0].content.parts if part.text is not None
+        ).strip()
+
+        result = PromptEnhancementResponse(
+            enhanced_prompt=enhanced_text,
             success=True
         )
+        if use_cache and enhanced_text:
+            cache_enhancement(cache_key, result)
+            if semantic_cache is not None:
+                await asyncio.to_thread(semantic_cache.insert, cache_namespace, prompt_embedding, enhanced_text)
+        return result
         
     except Exception as e:
-        error_message = str(e)
-        if "API_KEY" in error_message:
-            error_message = "Invalid API key. Please check your Gemini API key."
-        elif "quota" in error_message.lower():
-            error_message = "API quota exceeded. Please check your Gemini API usage."
-        
         return PromptEnhancementResponse(
             enhanced_prompt="",
             success=False,
-            error=error_message
+            error=friendly_error_message(e)
         )
 
+@app.get("/img/{token}")
+async def get_image(token: str):
+    item = get_stored_image(token)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Image not found or expired")
+    image_bytes, mime_type = item
+    # Tokens are random and never reused, so the browser may cache the bytes for the token's lifetime
+    return Response(
+        content=image_bytes,
+        media_type=mime_type,
+        headers={"Cache-Control": f"private, max-age={IMAGE_STORE_TTL_SECONDS}, immutable"},
+    )
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # "auto" picks uvloop and httptools when they are installed (see README); each worker keeps its own caches
+    workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+    # Worker processes need an import string; a single worker serves this module's app directly
+    # so it isn't imported a second time as "main"
+    uvicorn.run(
+        "main:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=workers,
+    )
@@ -111,6 +111,17 @@ export const useChat = () => {
     setMessages(prev => [...prev, userMessage]);
     setIsLoading(true);
 
+    // Streamed chat answers render into this message while they arrive
+    const aiMessageId = generateId();
+    const showPartialText = (partialText: string) => {
+      setMessages(prev => {
+        if (prev.some(m => m.id === aiMessageId)) {
+          return prev.map(m => (m.id === aiMessageId ? { ...m, text: partialText } : m));
+        }
+        return [...prev, { id: aiMessageId, text: partialText, sender: 'ai', timestamp: new Date() }];
+      });
+    };
+
     try {
       const response = await generateCircuit({
         prompt: text,
@@ -119,13 +130,13 @@ export const useChat = () => {
         paintedImage: paintedImageDataUrl || undefined,
         mode,
         apiKey
-      });
+      }, showPartialText);
 
       // If the backend returned an image data URL, convert it to a blob URL for more reliable rendering
       const imageUrl = response.imageUrl ? dataUrlToBlobUrl(response.imageUrl) : undefined;
 
       const aiMessage: Message = {
-        id: generateId(),
+        id: aiMessageId,
         text: response.text || 'Generated circuit diagram',
         sender: 'ai',
         timestamp: new Date(),
@@ -139,7 +150,11 @@ export const useChat = () => {
         imageUrlPrefix: response.imageUrl ? response.imageUrl.substring(0, 50) : null
       });
 
-      setMessages(prev => [...prev, aiMessage]);
+      setMessages(prev =>
+        prev.some(m => m.id === aiMessageId)
+          ? prev.map(m => (m.id === aiMessageId ? aiMessage : m))
+          : [...prev, aiMessage]
+      );
 
       if (imageUrl) {
         console.log('Setting current image from response');
@@ -18,7 +18,92 @@ interface GenerateRequest extends CircuitGenerationRequest {
   apiKey: string;
 }
 
-export const generateCircuit = async (request: GenerateRequest): Promise<CircuitGenerationResponse> => {
+// With the backend image store enabled, images come back as `/img/{token}` paths instead of data URLs.
+// The app keeps a data URL so the image can be sent back for edits, so fetch the bytes and convert.
+const resolveImageUrl = async (imageUrl?: string): Promise<string | undefined> => {
+  if (!imageUrl || !imageUrl.startsWith('/img/')) return imageUrl;
+  const response = await fetch(`${API_BASE_URL}${imageUrl}`);
+  if (!response.ok) {
+    throw new Error(`Failed to load generated image: ${response.status}`);
+  }
+  const blob = await response.blob();
+  return new Promise((resolve, reject) => {
+    const reader = new FileReader();
+    reader.onload = () => resolve(reader.result as string);
+    reader.onerror = () => reject(reader.error);
+    reader.readAsDataURL(blob);
+  });
+};
+
+// Read a text/event-stream body of `data: {...}` events, reporting accumulated text as it grows.
+// Image generations also send one `image_url` event before `done`.
+const readEventStream = async (
+  response: Response,
+  onText?: (text: string) => void
+): Promise<CircuitGenerationResponse> => {
+  const reader = response.body!.getReader();
+  const decoder = new TextDecoder();
+  // Pieces of the event being received; joined once its boundary arrives so a multi-MB
+  // image event isn't re-copied and re-scanned on every read
+  const pending: string[] = [];
+  let text = '';
+  let imageUrl: string | undefined;
+  let error: string | undefined;
+
+  const handleEvent = (event: string) => {
+    if (!event.startsWith('data: ')) return;
+    const data = JSON.parse(event.slice(6));
+    if (data.error) {
+      error = data.error;
+    }
+    if (data.text) {
+      text += data.text;
+      onText?.(text);
+    }
+    if (data.image_url) {
+      imageUrl = data.image_url;
+    }
+  };
+
+  const finishEvent = (last: string) => {
+    pending.push(last);
+    handleEvent(pending.join(''));
+    pending.length = 0;
+  };
+
+  while (error === undefined) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    let piece = decoder.decode(value, { stream: true });
+
+    // A "\n\n" boundary split across two reads
+    const previous = pending[pending.length - 1];
+    if (previous?.endsWith('\n') && piece.startsWith('\n')) {
+      pending[pending.length - 1] = previous.slice(0, -1);
+      finishEvent('');
+      piece = piece.slice(1);
+    }
+
+    let boundary = piece.indexOf('\n\n');
+    while (boundary !== -1 && error === undefined) {
+      finishEvent(piece.slice(0, boundary));
+      piece = piece.slice(boundary + 2);
+      boundary = piece.indexOf('\n\n');
+    }
+    if (piece) pending.push(piece);
+  }
+
+  if (error !== undefined) {
+    reader.cancel().catch(() => {});
+    return { success: false, error };
+  }
+  return { text, imageUrl: await resolveImageUrl(imageUrl), success: true };
+};
+
+export const generateCircuit = async (
+  request: GenerateRequest,
+  onText?: (text: string) => void
+): Promise<CircuitGenerationResponse> => {
   try {
     // Map frontend camelCase to backend snake_case expected by FastAPI
     const payload = {
@@ -47,6 +132,11 @@ export const generateCircuit = async (request: GenerateRequest): Promise<Circuit
       throw new Error(`HTTP error! status: ${response.status}${detail}`);
     }
 
+    // Fresh generations are streamed as Server-Sent Events; cache hits are a single JSON body
+    if (response.headers.get('content-type')?.startsWith('text/event-stream')) {
+      return await readEventStream(response, onText);
+    }
+
     const data = await response.json();
     
     // Debug logging
@@ -60,7 +150,7 @@ export const generateCircuit = async (request: GenerateRequest): Promise<Circuit
     // Normalize snake_case from backend to camelCase expected by the app
     const normalized: CircuitGenerationResponse = {
       text: data.text,
-      imageUrl: data.image_url,
+      imageUrl: await resolveImageUrl(data.image_url),
       success: data.success,
       error: data.error,
     };